@@ -0,0 +1,142 @@
+"""Compare Singer ingest throughput of the default and fast ingest paths.
+
+Usage:
+    poetry run python benchmarks/ingest_benchmark.py [--input payload_example/data.singer] [--repeat 20000]
+
+Both paths run through TargetDynamicsOnprem's reader and the SDK's record
+handling (stream maps, validation, preprocessing hooks). Only the sinks are
+replaced by sinks that make no requests.
+
+The input is repeated along with `Bills` records carrying decimal amounts and
+fractional-second timestamps, as real tap output does.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from target_dynamics_onprem.client import DynamicOnpremSink
+from target_dynamics_onprem.target import TargetDynamicsOnprem
+
+
+BILLS_SCHEMA = {
+    "type": "SCHEMA",
+    "stream": "Bills",
+    "schema": {
+        "type": ["object", "null"],
+        "properties": {
+            "id": {"type": ["string", "null"]},
+            "vendorId": {"type": ["string", "null"]},
+            "currency": {"type": ["string", "null"]},
+            "issueDate": {"type": ["string", "null"], "format": "date-time"},
+            "dueDate": {"type": ["string", "null"], "format": "date-time"},
+            "totalAmount": {"type": ["number", "null"]},
+            "taxAmount": {"type": ["number", "null"]},
+            "lineItems": {
+                "type": ["array", "null"],
+                "items": {
+                    "type": ["object", "null"],
+                    "properties": {
+                        "productId": {"type": ["string", "null"]},
+                        "quantity": {"type": ["number", "null"]},
+                        "unitPrice": {"type": ["number", "null"]},
+                        "totalPrice": {"type": ["number", "null"]},
+                        "serviceDate": {"type": ["string", "null"], "format": "date-time"},
+                    },
+                },
+            },
+        },
+    },
+    "key_properties": [],
+}
+
+
+def bill_record(i):
+    unit_price = round(10.25 + i % 100 * 0.37, 2)
+    return {
+        "type": "RECORD",
+        "stream": "Bills",
+        "record": {
+            "id": f"B-{i}",
+            "vendorId": "30000",
+            "currency": "USD",
+            "issueDate": f"2023-08-25T15:51:16.{i % 1000000:06d}Z",
+            "dueDate": "2023-09-25T00:00:00.5Z",
+            "totalAmount": round(unit_price * 2.5, 2),
+            "taxAmount": round(unit_price * 0.18, 2),
+            "lineItems": [
+                {
+                    "productId": "1896-S",
+                    "quantity": 2.5,
+                    "unitPrice": unit_price,
+                    "totalPrice": round(unit_price * 2.5, 2),
+                    "serviceDate": f"2023-08-25T00:00:00.{i % 1000:03d}Z",
+                }
+            ],
+        },
+    }
+
+
+class NullSink(DynamicOnpremSink):
+    """Sink that accepts every record without calling the API."""
+
+    @property
+    def name(self):
+        return self.stream_name
+
+    def preprocess_record(self, record: dict, context: dict):
+        return record
+
+    def process_record(self, record: dict, context: dict) -> None:
+        pass
+
+
+class BenchmarkTarget(TargetDynamicsOnprem):
+    def get_sink_class(self, stream_name: str):
+        return NullSink
+
+
+def run(path, fast_ingest):
+    target = BenchmarkTarget(
+        config={
+            "url_base": "http://localhost/api/",
+            "company_id": "benchmark",
+            "fast_ingest": fast_ingest,
+        },
+        validate_config=False,
+    )
+    with open(path) as file_input:
+        stats = target._process_lines(file_input)
+    return sum(stats.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input", default="payload_example/data.singer")
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    with open(args.input) as f:
+        lines = f.read().splitlines()
+    schemas = [line for line in lines if json.loads(line)["type"] == "SCHEMA"]
+    schemas.append(json.dumps(BILLS_SCHEMA))
+    others = [line for line in lines if json.loads(line)["type"] != "SCHEMA"]
+
+    with tempfile.NamedTemporaryFile("w", suffix=".singer", delete=False) as tmp:
+        tmp.write("\n".join(schemas) + "\n")
+        for i in range(args.repeat):
+            tmp.write("\n".join(others) + "\n")
+            tmp.write(json.dumps(bill_record(i)) + "\n")
+    try:
+        for name, fast_ingest in (("default", False), ("fast", True)):
+            start = time.perf_counter()
+            count = run(tmp.name, fast_ingest)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>8}: {count} messages in {elapsed:.2f}s, {count / elapsed:,.0f} msg/s")
+    finally:
+        os.remove(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ from datetime import datetime
 import ast
 import requests
 import base64
+from target_dynamics_onprem.ingest import iter_array, loads
 
 
 class DynamicOnpremSink(HotglueSink):
@@ -23,6 +24,9 @@ class DynamicOnpremSink(HotglueSink):
         key_properties,
     ) -> None:
         super().__init__(target, stream_name, schema, key_properties)
+        if target.config.get("fast_ingest"):
+            # reuse the validator compiled for this stream's schema
+            self._validator = target.validator_cache.get(stream_name, schema)
 
     @property
     def company_key(self):
@@ -126,6 +130,12 @@ class DynamicOnpremSink(HotglueSink):
 
     def parse_objs(self, obj):
         try:
+            if self.config.get("fast_ingest"):
+                # most stringified fields are JSON, try the fast decoder first
+                try:
+                    return loads(obj)
+                except:
+                    return ast.literal_eval(obj)
             try:
                 return ast.literal_eval(obj)
             except:
@@ -133,6 +143,14 @@ class DynamicOnpremSink(HotglueSink):
         except:
             return obj
     
+    def iter_objs(self, obj):
+        """Yield the items of a list or of a stringified list one at a time."""
+        return iter_array(obj, parse=self.parse_objs)
+
+    @property
+    def stream_lines(self):
+        return self.config.get("stream_document_lines", False)
+
     def process_custom_fields(self, custom_fields):
         output = {}
         if isinstance(custom_fields, str):
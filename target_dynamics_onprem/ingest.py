@@ -0,0 +1,215 @@
+"""Fast Singer message ingest helpers for target-dynamics-onprem."""
+import ast
+import decimal
+import io
+import json
+import re
+import sys
+import hashlib
+
+from json.decoder import WHITESPACE
+
+from jsonschema import Draft7Validator, FormatChecker
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fastjsonschema
+    import fastjsonschema.draft07
+except ImportError:
+    fastjsonschema = None
+
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+# without a "." a float needs an exponent, i.e. a digit followed by e/E
+EXPONENT_RE = re.compile(r"\d[eE]")
+
+
+def loads(data):
+    """Decode a JSON document, using orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. NaN or integers orjson can't hold, let json decide
+            pass
+    return json.loads(data)
+
+
+def loads_message(line):
+    """Decode a Singer message line like the SDK does, floats as Decimal.
+
+    orjson has no Decimal support, so it is only used for lines that can't
+    hold a float: no "." at all (a cheap memchr) and no exponent. Any other
+    line goes straight to json with `parse_float`, at the SDK's own cost.
+    """
+    if orjson is not None and "." not in line and not EXPONENT_RE.search(line):
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(line, parse_float=decimal.Decimal)
+
+
+def iter_messages(file_input=None, buffer_size=DEFAULT_BUFFER_SIZE, logger=None):
+    """Yield decoded Singer messages read through a large buffer.
+
+    Nested stringified fields (e.g. `lineItems`, `invoiceItem`) are left as
+    strings here, the sinks decode them only when they are actually mapped.
+    """
+    file_input = file_input or sys.stdin
+    wrapped = None
+    try:
+        # re-open the underlying descriptor with a much larger read buffer
+        lines = io.open(
+            file_input.fileno(), "r", encoding="utf-8", buffering=buffer_size, closefd=False
+        )
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        lines = file_input
+        if isinstance(file_input, (io.RawIOBase, io.BufferedIOBase)):
+            lines = wrapped = io.TextIOWrapper(file_input, encoding="utf-8")
+    # text lines, as json decodes str faster than it detects a bytes encoding
+    json_loads = json.loads
+    try:
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                # same as loads_message, inlined as it runs for every line
+                if orjson is not None and "." not in line and not EXPONENT_RE.search(line):
+                    try:
+                        message = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        message = json_loads(line, parse_float=decimal.Decimal)
+                else:
+                    message = json_loads(line, parse_float=decimal.Decimal)
+            except json.decoder.JSONDecodeError as exc:
+                if logger:
+                    logger.error("Unable to parse:\n%s", line, exc_info=exc)
+                raise
+            yield message
+    finally:
+        if wrapped is not None:
+            # don't close the caller's stream with the wrapper
+            wrapped.detach()
+
+
+def iter_json_array(data):
+    """Decode the items of a stringified JSON array one at a time."""
+    decoder = json.JSONDecoder()
+    end = len(data)
+    idx = WHITESPACE.match(data, 0).end()
+    if idx == end or data[idx] != "[":
+        raise ValueError("Not a JSON array")
+    idx = WHITESPACE.match(data, idx + 1).end()
+    if idx < end and data[idx] == "]":
+        return
+    while True:
+        item, idx = decoder.raw_decode(data, idx)
+        yield item
+        idx = WHITESPACE.match(data, idx).end()
+        if idx < end and data[idx] == ",":
+            idx = WHITESPACE.match(data, idx + 1).end()
+        elif idx < end and data[idx] == "]":
+            return
+        else:
+            raise ValueError(f"Expecting ',' or ']' at char {idx}")
+
+
+def iter_array(data, parse=ast.literal_eval):
+    """Yield the items of a list or of a stringified list one at a time.
+
+    A string that isn't a JSON array (e.g. a python literal) is decoded whole
+    with `parse`. A JSON array that is malformed partway raises ValueError
+    once the items before the error have been yielded.
+    """
+    if isinstance(data, str):
+        started = False
+        try:
+            for item in iter_json_array(data):
+                started = True
+                yield item
+            return
+        except ValueError:
+            if started:
+                raise
+            data = parse(data)
+    for item in data or []:
+        yield item
+
+
+def format_checks(format_checker):
+    """fastjsonschema formats that defer to a jsonschema FormatChecker.
+
+    fastjsonschema's own format regexes are stricter than jsonschema's (e.g.
+    `date-time` requires a timezone), so every format is checked the same
+    way the default path checks it.
+    """
+    names = set(format_checker.checkers)
+    names.update(fastjsonschema.draft07.CodeGeneratorDraft07.FORMAT_REGEXS)
+    names.add("regex")
+    return {
+        name: (lambda value, name=name: format_checker.conforms(value, name))
+        for name in names
+    }
+
+
+class CompiledValidator:
+    """Schema validator compiled once, with the `validate` API of jsonschema.
+
+    A record is accepted exactly when jsonschema's Draft7Validator accepts
+    it. The compiled fastjsonschema function is only a fast path for valid
+    records, anything it rejects is validated again by jsonschema, which
+    raises the same error as the default path.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        format_checker = FormatChecker()
+        self._validator = Draft7Validator(schema, format_checker=format_checker)
+        self._compiled = None
+        if fastjsonschema is not None:
+            try:
+                self._compiled = fastjsonschema.compile(
+                    schema,
+                    formats=format_checks(format_checker),
+                    use_default=False,
+                )
+            except Exception:
+                # fall back to jsonschema for schemas fastjsonschema can't compile
+                self._compiled = None
+
+    def validate(self, record):
+        if self._compiled is not None:
+            try:
+                self._compiled(record)
+                return
+            except fastjsonschema.JsonSchemaException:
+                pass
+        self._validator.validate(record)
+
+
+class ValidatorCache:
+    """Keep one compiled validator per stream and schema version."""
+
+    def __init__(self):
+        self._validators = {}
+
+    @staticmethod
+    def schema_key(schema):
+        return hashlib.md5(
+            json.dumps(schema, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def get(self, stream_name, schema):
+        key = (stream_name, self.schema_key(schema))
+        validator = self._validators.get(key)
+        if validator is None:
+            validator = CompiledValidator(schema)
+            self._validators[key] = validator
+        return validator
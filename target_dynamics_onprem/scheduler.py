@@ -0,0 +1,157 @@
+"""Dependency-aware record scheduler for target-dynamics-onprem."""
+import threading
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from target_dynamics_onprem.ingest import iter_array
+
+# records submitted but not yet processed, across all streams
+DEFAULT_MAX_QUEUED = 50
+
+
+class StreamScheduler:
+    """Process records of different streams concurrently.
+
+    Records of one stream run one at a time, in input order, because a sink
+    keeps per-record state (e.g. its endpoint). Streams run concurrently with
+    each other, except that a document referencing a vendor or item that is
+    still pending creation earlier in this run is held back until that record
+    has been processed. Independent documents queued behind it go ahead.
+
+    At most `max_queued` records are held in memory, `submit` blocks until
+    one has been processed once the bound is reached.
+    """
+
+    # stream -> (reference kind, record fields identifying the created record)
+    PROVIDERS = {
+        "Vendors": ("vendor", ("id", "vendorNumber")),
+        "Items": ("item", ("id", "sku")),
+    }
+    DOCUMENT_STREAMS = ("Bills", "PurchaseOrders", "PurchaseInvoices")
+
+    def __init__(self, max_workers, max_queued=None, logger=None):
+        self.logger = logger
+        self.max_queued = max_queued or DEFAULT_MAX_QUEUED
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="stream-scheduler"
+        )
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._lanes = defaultdict(deque)
+        self._busy = set()
+        self._pending = Counter()
+        self._pending_kinds = Counter()
+        self._queued = 0
+        self._error = None
+
+    def provides(self, stream_name, record):
+        """References this record creates once it is committed."""
+        if stream_name not in self.PROVIDERS:
+            return []
+        kind, fields = self.PROVIDERS[stream_name]
+        return [(kind, str(record[f])) for f in fields if record.get(f)]
+
+    def requires(self, stream_name, record):
+        """Pending vendors and items this document depends on.
+
+        Only references that are pending right now are returned. Pending
+        references are only added by the thread calling `submit`, so one that
+        isn't pending here can't become pending before the record is queued.
+        Lines are only scanned while an item is pending, one at a time.
+        """
+        if stream_name not in self.DOCUMENT_STREAMS:
+            return []
+        keys = []
+        vendor = ("vendor", str(record.get("vendorId")))
+        if record.get("vendorId") and self._pending[vendor]:
+            keys.append(vendor)
+        if not self._pending_kinds["item"]:
+            return keys
+        for line in self.iter_lines(record.get("lineItems")):
+            if not isinstance(line, dict):
+                continue
+            product = line.get("productId") or line.get("productNumber")
+            item = ("item", str(product))
+            if product and self._pending[item] and item not in keys:
+                keys.append(item)
+        return keys
+
+    @staticmethod
+    def iter_lines(lines):
+        try:
+            yield from iter_array(lines)
+        except Exception:
+            # malformed lines, the sink will report them
+            return
+
+    def in_worker(self):
+        return getattr(self._local, "active", False)
+
+    def submit(self, stream_name, record, func):
+        """Queue `func` to process `record` of `stream_name`."""
+        provides = self.provides(stream_name, record)
+        requires = [k for k in self.requires(stream_name, record) if k not in provides]
+        with self._cond:
+            while self._queued >= self.max_queued and self._error is None:
+                self._cond.wait()
+            self._raise_error()
+            for key in provides:
+                self._pending[key] += 1
+                self._pending_kinds[key[0]] += 1
+            self._lanes[stream_name].append((provides, requires, func))
+            self._queued += 1
+            self._dispatch()
+
+    def wait(self):
+        """Block until every queued record has been processed."""
+        with self._cond:
+            while self._queued:
+                self._cond.wait()
+            self._raise_error()
+
+    def shutdown(self):
+        self.wait()
+        self._executor.shutdown()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _dispatch(self):
+        # must be called holding self._cond
+        for stream_name, lane in self._lanes.items():
+            if stream_name in self._busy:
+                continue
+            for i, task in enumerate(lane):
+                held = [key for key in task[1] if self._pending[key]]
+                if held:
+                    if self.logger and i == 0:
+                        self.logger.debug(f"Holding {stream_name} record until {held} are created")
+                    continue
+                del lane[i]
+                self._busy.add(stream_name)
+                self._executor.submit(self._run, stream_name, task)
+                break
+
+    def _run(self, stream_name, task):
+        provides, _, func = task
+        self._local.active = True
+        try:
+            func()
+        except Exception as e:
+            with self._cond:
+                self._error = self._error or e
+        finally:
+            self._local.active = False
+            with self._cond:
+                # release dependents even on failure, they will surface their own error
+                for key in provides:
+                    self._pending_kinds[key[0]] -= 1
+                    self._pending[key] -= 1
+                    if self._pending[key] <= 0:
+                        del self._pending[key]
+                self._busy.discard(stream_name)
+                self._queued -= 1
+                self._dispatch()
+                self._cond.notify_all()
@@ -0,0 +1,475 @@
+"""Run one Singer stream across several target-dynamics-onprem processes.
+
+The coordinator splits the input by company and document id, so a document
+header and its lines are always loaded by the same worker. SCHEMA and
+ACTIVATE_VERSION messages are sent to every shard. Each shard is written
+to a spool file in the work directory and loaded by its own worker
+process. Worker commands may run on other hosts, e.g. through ssh. When
+all shards are done their STATE messages are merged back into one state
+in input order and written to stdout.
+
+Successful shards are marked done in the work directory. A failed shard is
+retried on its own, and `--resume` reruns only the shards that are not done.
+A retry skips the records the failed attempt reported as successful in its
+last STATE. Records it posted after that STATE are posted again. Workers get
+a copy of the config with `concurrent_streams` disabled, as results are
+matched to records by their order within a stream.
+
+STATE messages from the tap are not forwarded to the workers, the output
+state is the merged state of the workers.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import time
+import zlib
+
+from target_dynamics_onprem.ingest import loads
+
+LOGGER = logging.getLogger("target-dynamics-onprem.shard")
+DEFAULT_WORKER_COMMAND = "target-dynamicsonprem --config {config}"
+BROADCAST_TYPES = ("SCHEMA", "ACTIVATE_VERSION")
+DOCUMENT_ID_FIELDS = ("id", "externalId", "number", "invoiceNumber")
+
+
+def shard_key(record, company_id=None):
+    """Deterministic routing key built from company and document id."""
+    company = record.get("subsidiary") or company_id or ""
+    for field in DOCUMENT_ID_FIELDS:
+        if record.get(field) not in (None, ""):
+            document_id = str(record[field])
+            break
+    else:
+        # no id, fall back to the record content so reruns route it the same way
+        document_id = hashlib.md5(
+            json.dumps(record, sort_keys=True, default=str).encode()
+        ).hexdigest()
+    return f"{company}:{document_id}"
+
+
+def shard_for(record, shards, company_id=None):
+    return zlib.crc32(shard_key(record, company_id).encode()) % shards
+
+
+class Shard:
+    """One worker's share of the input and the results of its attempts.
+
+    `results` holds the bookmark entry of every record that has a result,
+    per stream and keyed by the record's position among the shard's records
+    of that stream. An entry with an `externalId` is matched to the record
+    with that `externalId`. Other entries are matched to the remaining
+    records by order, as the target appends one bookmark per record in the
+    order it processes them.
+    """
+
+    def __init__(self, index, workdir, command):
+        self.index = index
+        self.command = command
+        self.records = 0
+        self.attempts = 0
+        self.process = None
+        self.started_at = None
+        self.elapsed = None
+        self.results = {}
+        self.carried = {}
+        self.state = {}
+        self.positions = {}
+        self.keys = {}
+        self.resolved_at_start = 0
+        self.attempt_processed = 0
+        self._output_offset = 0
+        self.input_path = os.path.join(workdir, f"shard-{index:03d}.singer")
+        self.retry_input_path = os.path.join(workdir, f"shard-{index:03d}.retry.singer")
+        self.log_path = os.path.join(workdir, f"shard-{index:03d}.log")
+        self.done_path = os.path.join(workdir, f"shard-{index:03d}.done")
+        self.results_path = os.path.join(workdir, f"shard-{index:03d}.results.json")
+        self.workdir = workdir
+
+    @property
+    def done(self):
+        return os.path.exists(self.done_path)
+
+    @property
+    def output_path(self):
+        return os.path.join(self.workdir, f"shard-{self.index:03d}.attempt-{self.attempts}.out")
+
+    @property
+    def resolved(self):
+        return sum(len(entries) for entries in self.results.values())
+
+    def reset(self):
+        for path in (self.done_path, self.results_path, self.retry_input_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load(self):
+        """Load the results of earlier runs, e.g. when resuming."""
+        if os.path.exists(self.results_path):
+            with open(self.results_path) as f:
+                saved = json.load(f)
+            self.results = saved["results"]
+            self.carried = saved["carried"]
+            self.state = saved["state"]
+
+    def save(self):
+        with open(self.results_path, "w") as f:
+            json.dump({"results": self.results, "carried": self.carried, "state": self.state}, f)
+
+    def write_attempt_input(self):
+        """Return the input for the next attempt, without records that have a result."""
+        self.positions = {}
+        self.keys = {}
+        counters = {}
+        skip = bool(self.resolved)
+        output = open(self.retry_input_path, "wb") if skip else None
+        try:
+            with open(self.input_path, "rb") as f:
+                for line in f:
+                    message = loads(line)
+                    if message["type"] == "RECORD":
+                        stream = message["stream"]
+                        position = counters.get(stream, 0)
+                        counters[stream] = position + 1
+                        if str(position) in self.results.get(stream, {}):
+                            continue
+                        self.positions.setdefault(stream, []).append(position)
+                        self.keys.setdefault(stream, []).append(
+                            message["record"].get("externalId")
+                        )
+                    if output:
+                        output.write(line)
+        finally:
+            if output:
+                output.close()
+        return self.retry_input_path if skip else self.input_path
+
+    def mark_done(self):
+        with open(self.done_path, "w") as f:
+            f.write(json.dumps({"records": self.records, "elapsed": self.elapsed}))
+
+    def start(self):
+        """Start a worker for the records without a result.
+
+        Return False, and mark the shard done, when no records are left.
+        """
+        if self.resolved >= self.records:
+            LOGGER.info(f"Shard {self.index} has no records left to load, marking it done")
+            self.elapsed = 0.0
+            self.mark_done()
+            return False
+        self.attempts += 1
+        input_path = self.write_attempt_input()
+        self.resolved_at_start = self.resolved
+        self.attempt_processed = 0
+        self._output_offset = 0
+        self.started_at = time.monotonic()
+        self.elapsed = None
+        LOGGER.info(
+            f"Starting shard {self.index} (attempt {self.attempts}, "
+            f"{self.records - self.resolved_at_start} records): {self.command}"
+        )
+        with open(input_path, "rb") as stdin, open(
+            self.output_path, "wb"
+        ) as stdout, open(self.log_path, "ab") as stderr:
+            self.process = subprocess.Popen(
+                self.command, shell=True, stdin=stdin, stdout=stdout, stderr=stderr
+            )
+        return True
+
+    def poll(self):
+        """Return the exit code once the worker has finished, else None."""
+        code = self.process.poll()
+        if code is not None:
+            self.elapsed = time.monotonic() - self.started_at
+            self.collect(succeeded=code == 0)
+            if code == 0:
+                self.mark_done()
+        return code
+
+    def read_output(self):
+        """Read the worker's new output, return its latest STATE value if any."""
+        state = None
+        with open(self.output_path, "rb") as f:
+            f.seek(self._output_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # partially written, read it again next time
+                    break
+                self._output_offset += len(line)
+                try:
+                    message = loads(line)
+                except ValueError:
+                    continue
+                if isinstance(message, dict) and message.get("type") == "STATE":
+                    state = message.get("value") or {}
+        if state is not None:
+            self.attempt_processed = sum(
+                len(entries) for entries in state.get("bookmarks", {}).values()
+            )
+        return state
+
+    def collect(self, succeeded):
+        """Keep the results of the finished attempt.
+
+        After a failed attempt only successful records are kept, so a retry
+        doesn't create them again in Dynamics. Failed records are retried.
+        """
+        self._output_offset = 0
+        state = self.read_output() or {}
+        for stream, entries in state.get("bookmarks", {}).items():
+            results = self.results.setdefault(stream, {})
+            for position, entry in self.match(stream, entries):
+                if succeeded:
+                    results[str(position)] = entry
+                elif isinstance(entry, dict) and entry.get("success"):
+                    results[str(position)] = entry
+                    self.carried[stream] = self.carried.get(stream, 0) + 1
+        if succeeded:
+            self.state = {k: v for k, v in state.items() if k != "bookmarks"}
+        self.save()
+
+    def match(self, stream, entries):
+        """Pair this attempt's bookmark entries of `stream` with record positions."""
+        positions = self.positions.get(stream, [])
+        by_key = {}
+        for position, key in zip(positions, self.keys.get(stream, [])):
+            if key not in (None, ""):
+                by_key.setdefault(str(key), []).append(position)
+        matched = []
+        unmatched = []
+        for entry in entries:
+            key = entry.get("externalId") if isinstance(entry, dict) else None
+            if key not in (None, "") and by_key.get(str(key)):
+                matched.append((by_key[str(key)].pop(0), entry))
+            else:
+                unmatched.append(entry)
+        taken = {position for position, _ in matched}
+        remaining = [position for position in positions if position not in taken]
+        return matched + list(zip(remaining, unmatched))
+
+    def progress(self):
+        if self.elapsed is None:
+            self.read_output()
+        elapsed = self.elapsed or time.monotonic() - self.started_at
+        processed = self.resolved if self.elapsed is not None else self.resolved_at_start + self.attempt_processed
+        rate = (processed - self.resolved_at_start) / elapsed if elapsed else 0
+        return (
+            f"shard {self.index}: {processed}/{self.records} records, "
+            f"{elapsed:.1f}s, {rate:,.1f} records/s"
+        )
+
+    def final_state(self):
+        """State of the shard, with the results of every attempt."""
+        state = json.loads(json.dumps(self.state))
+        # records kept from failed attempts are missing from the last attempt's summary
+        if self.carried:
+            summary = state.setdefault("summary", {})
+            for stream, count in self.carried.items():
+                counts = summary.setdefault(stream, {})
+                counts["success"] = counts.get("success", 0) + count
+        bookmarks = {
+            stream: [entries[position] for position in sorted(entries, key=int)]
+            for stream, entries in self.results.items()
+            if entries
+        }
+        if bookmarks:
+            state["bookmarks"] = bookmarks
+        return state
+
+
+def split(file_input, shards, company_id=None):
+    """Write each shard's input file and return the routing of every record."""
+    outputs = [open(shard.input_path, "wb") for shard in shards]
+    routing = {}
+    try:
+        for line in getattr(file_input, "buffer", file_input):
+            if not line.strip():
+                continue
+            message = loads(line)
+            line = line.rstrip(b"\r\n") + b"\n"
+            if message["type"] == "RECORD":
+                index = shard_for(message["record"], len(shards), company_id)
+                outputs[index].write(line)
+                shards[index].records += 1
+                routing.setdefault(message["stream"], []).append(index)
+            elif message["type"] in BROADCAST_TYPES:
+                for output in outputs:
+                    output.write(line)
+    finally:
+        for output in outputs:
+            output.close()
+    return routing
+
+
+def merge_values(merged, value):
+    """Merge a shard's state value into `merged`, summing counters."""
+    for key, val in value.items():
+        if key not in merged:
+            merged[key] = val
+        elif isinstance(val, dict) and isinstance(merged[key], dict):
+            merge_values(merged[key], val)
+        elif isinstance(val, list) and isinstance(merged[key], list):
+            merged[key] = merged[key] + val
+        elif isinstance(val, (int, float)) and not isinstance(val, bool):
+            merged[key] = merged[key] + val
+    return merged
+
+
+def merge_states(states, routing):
+    """Merge per-shard states, keeping bookmarks in input record order."""
+    merged = {}
+    for state in states:
+        merge_values(merged, {k: v for k, v in state.items() if k != "bookmarks"})
+
+    bookmarks = {}
+    streams = set(routing)
+    for state in states:
+        streams.update(state.get("bookmarks", {}))
+    for stream in streams:
+        queues = [list(state.get("bookmarks", {}).get(stream, [])) for state in states]
+        positions = [0] * len(states)
+        entries = []
+        for index in routing.get(stream, []):
+            if positions[index] < len(queues[index]):
+                entries.append(queues[index][positions[index]])
+                positions[index] += 1
+        # entries not matched to a routed record (e.g. duplicates) go last
+        for index, queue in enumerate(queues):
+            entries.extend(queue[positions[index]:])
+        if entries:
+            bookmarks[stream] = entries
+    if bookmarks:
+        merged["bookmarks"] = bookmarks
+    return merged
+
+
+def run(shards, retries, progress_interval):
+    """Run the pending shards, retrying failed ones. Return the failed shards."""
+    running = [shard for shard in shards if not shard.done]
+    for shard in shards:
+        if shard.done:
+            LOGGER.info(f"Skipping shard {shard.index}, already done")
+    running = [shard for shard in running if shard.start()]
+
+    failed = []
+    last_report = time.monotonic()
+    while running:
+        time.sleep(0.5)
+        for shard in list(running):
+            code = shard.poll()
+            if code is None:
+                continue
+            if code == 0:
+                LOGGER.info(f"Finished {shard.progress()}")
+                running.remove(shard)
+            elif shard.attempts <= retries:
+                LOGGER.warning(
+                    f"Shard {shard.index} failed with exit code {code}, retrying "
+                    f"{shard.records - shard.resolved} records without a result. See {shard.log_path}"
+                )
+                if not shard.start():
+                    running.remove(shard)
+            else:
+                LOGGER.error(f"Shard {shard.index} failed with exit code {code}. See {shard.log_path}")
+                running.remove(shard)
+                failed.append(shard)
+        if running and time.monotonic() - last_report >= progress_interval:
+            last_report = time.monotonic()
+            for shard in running:
+                LOGGER.info(f"Running {shard.progress()}")
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--config",
+        required=True,
+        help="Target config file, a copy without concurrent_streams is passed to workers as {config}",
+    )
+    parser.add_argument("--input", help="Singer input file, defaults to stdin")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--workdir", default=".shards")
+    parser.add_argument(
+        "--worker-command",
+        action="append",
+        help=f"Command for a worker, repeat to spread shards round-robin over hosts (default: {DEFAULT_WORKER_COMMAND!r})",
+    )
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--progress-interval", type=float, default=30)
+    parser.add_argument("--resume", action="store_true", help="Reuse the split in --workdir and only run shards that are not done")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    with open(args.config) as f:
+        config = json.load(f)
+    os.makedirs(args.workdir, exist_ok=True)
+    manifest_path = os.path.join(args.workdir, "manifest.json")
+    # results are matched to records by order, which concurrent streams change
+    if config.get("concurrent_streams"):
+        LOGGER.warning("concurrent_streams is disabled in shard workers")
+    worker_config_path = os.path.join(args.workdir, "worker-config.json")
+    with open(os.open(worker_config_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(dict(config, concurrent_streams=False), f)
+    commands = [
+        command.format(config=shlex.quote(os.path.abspath(worker_config_path)))
+        for command in args.worker_command or [DEFAULT_WORKER_COMMAND]
+    ]
+
+    if args.resume:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        shards = [
+            Shard(i, args.workdir, commands[i % len(commands)])
+            for i in range(manifest["shards"])
+        ]
+        for shard, records in zip(shards, manifest["records"]):
+            shard.records = records
+            shard.load()
+        routing = manifest["routing"]
+    else:
+        shards = [
+            Shard(i, args.workdir, commands[i % len(commands)])
+            for i in range(args.shards)
+        ]
+        for shard in shards:
+            shard.reset()
+        if args.input:
+            with open(args.input, "rb") as file_input:
+                routing = split(file_input, shards, config.get("company_id"))
+        else:
+            routing = split(sys.stdin, shards, config.get("company_id"))
+        with open(manifest_path, "w") as f:
+            json.dump(
+                {
+                    "shards": len(shards),
+                    "records": [shard.records for shard in shards],
+                    "routing": routing,
+                },
+                f,
+            )
+
+    start = time.monotonic()
+    failed = run(shards, args.retries, args.progress_interval)
+    total = sum(shard.records for shard in shards)
+    elapsed = time.monotonic() - start
+    LOGGER.info(f"Processed {total} records on {len(shards)} shards in {elapsed:.1f}s")
+
+    if failed:
+        LOGGER.error(
+            f"Shards {[shard.index for shard in failed]} failed, rerun with --resume to retry only those"
+        )
+        sys.exit(1)
+
+    state = merge_states([shard.final_state() for shard in shards], routing)
+    sys.stdout.write(json.dumps({"type": "STATE", "value": state}) + "\n")
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
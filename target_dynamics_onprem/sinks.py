@@ -1,6 +1,8 @@
 """Dynamics-onprem target sink class, which handles writing streams."""
 import json
+from itertools import chain
 from target_dynamics_onprem.client import DynamicOnpremSink
+from target_dynamics_onprem.ingest import loads
 from datetime import datetime
 
 
@@ -64,7 +66,10 @@ class Items(DynamicOnpremSink):
         }
         if record.get("billItem", record.get("invoiceItem")):
             bill_item = record.get("billItem", record.get("invoiceItem"))
-            bill_item = json.loads(bill_item)
+            if self.config.get("fast_ingest"):
+                bill_item = loads(bill_item)
+            else:
+                bill_item = json.loads(bill_item)
             mapping["description2"] = bill_item.get("description")
             mapping["unitPrice"] = bill_item.get("unitPrice")
 
@@ -113,37 +118,53 @@ class PurchaseDocuments(DynamicOnpremSink):
         po_custom_fields = record.get("customFields")
         purchase_order_map.update(self.process_custom_fields(po_custom_fields))
 
-        lines = []
+        if self.stream_lines:
+            # lines are mapped and posted one at a time in upsert_record
+            mapping = self.clean_convert({"purchase_order": purchase_order_map})
+            mapping["lineItems"] = record.get("lineItems") or []
+            return mapping
+
         # add correlative line number
-        line_number = 0
-        for line in record.get("lineItems", []):
-            serviceDate = None
-            if line.get("serviceDate"):
-                serviceDate = self.convert_date(line.get("serviceDate"))
-            line_map = {
-                "quantity": line.get("quantity"),
-                "jobUnitPrice": line.get("unitPrice"),
-                "jobLineDiscountAmount": line.get("discount"),
-                "taxGroupCode": line.get("taxCode"),
-                "description": line.get("productName"),
-                "number": line.get("productId")
-                if documentType == "Order"
-                else line.get("accountNumber"),
-                "orderDate": serviceDate,
-                "type": "Item" if documentType == "Order" else "G/L Account",
-                "directUnitCost": line.get("unitPrice"),
-                "lineNumber": line_number,
-            }
-            line_number = line_number + 1
-            # map custom fields
-            custom_fields = line.get("customFields")
-            line_map.update(self.process_custom_fields(custom_fields))
-            lines.append(line_map)
+        lines = [
+            self.get_line_map(line, line_number, documentType)
+            for line_number, line in enumerate(record.get("lineItems", []))
+        ]
 
         payload = {"purchase_order": purchase_order_map, "lines": lines}
         mapping = self.clean_convert(payload)
         return mapping
 
+    def get_line_map(self, line, line_number, documentType):
+        serviceDate = None
+        if line.get("serviceDate"):
+            serviceDate = self.convert_date(line.get("serviceDate"))
+        line_map = {
+            "quantity": line.get("quantity"),
+            "jobUnitPrice": line.get("unitPrice"),
+            "jobLineDiscountAmount": line.get("discount"),
+            "taxGroupCode": line.get("taxCode"),
+            "description": line.get("productName"),
+            "number": line.get("productId")
+            if documentType == "Order"
+            else line.get("accountNumber"),
+            "orderDate": serviceDate,
+            "type": "Item" if documentType == "Order" else "G/L Account",
+            "directUnitCost": line.get("unitPrice"),
+            "lineNumber": line_number,
+        }
+        # map custom fields
+        custom_fields = line.get("customFields")
+        line_map.update(self.process_custom_fields(custom_fields))
+        return line_map
+
+    def iter_line_maps(self, line_items, documentType):
+        for line_number, line in enumerate(self.iter_objs(line_items)):
+            line_map = self.clean_convert(
+                self.get_line_map(line, line_number, documentType)
+            )
+            if line_map:
+                yield line_map
+
     def upsert_record(self, record: dict, context: dict):
         state_updates = dict()
         if record:
@@ -157,21 +178,32 @@ class PurchaseDocuments(DynamicOnpremSink):
             if purchase_order and purchase_order.get("number"):
                 pol_endpoint = self.endpoint.split("/")[0] + "/purchaseDocumentLines"
 
-                for line in record.get("lines", []):
-                    line["documentType"] = purchase_order.get("documentType")
-                    line["documentNumber"] = purchase_order.get("number")
-                    try:
+                if "lineItems" in record:
+                    lines = self.iter_line_maps(
+                        record["lineItems"],
+                        record["purchase_order"].get("documentType"),
+                    )
+                else:
+                    lines = record.get("lines", [])
+
+                # index of the line being decoded or posted
+                line_index = 0
+                try:
+                    for line in lines:
+                        line["documentType"] = purchase_order.get("documentType")
+                        line["documentNumber"] = purchase_order.get("number")
                         purchase_order_lines = self.request_api(
                             "POST", endpoint=pol_endpoint, request_data=line
                         )
-                    except Exception as e:
-                        self.logger.info(f"Posting line {line} has failed")
-                        self.logger.info("Deleting purchase order header")
-                        delete_endpoint = f"{self.endpoint}({purchase_order.get('id')})"
-                        purchase_order_lines = self.request_api(
-                            "DELETE", endpoint=delete_endpoint
-                        )
-                        raise Exception(e)
+                        line_index += 1
+                except Exception as e:
+                    self.logger.info(f"Posting line {line_index} has failed")
+                    self.logger.info("Deleting purchase order header")
+                    delete_endpoint = f"{self.endpoint}({purchase_order.get('id')})"
+                    purchase_order_lines = self.request_api(
+                        "DELETE", endpoint=delete_endpoint
+                    )
+                    raise Exception(e)
 
             purchase_order_id = purchase_order["number"]
             self.logger.info(
@@ -217,37 +249,52 @@ class Purchase_Invoice(DynamicOnpremSink):
         po_custom_fields = record.get("customFields")
         purchase_order_map.update(self.process_custom_fields(po_custom_fields))
 
+        if self.stream_lines:
+            # lines are mapped and posted one at a time in upsert_record
+            mapping = self.clean_convert(
+                {"purchase_invoice": purchase_order_map, "attachments": record.get("attachments") or []}
+            )
+            mapping["lineItems"] = record.get("lineItems") or []
+            return mapping
+
         # map lines
-        lines = []
         pi_lines = record.get("lineItems")
         if isinstance(pi_lines, str):
             pi_lines = self.parse_objs(pi_lines)
-        for line in pi_lines:
-            type = (
-                "G/L Account"
-                if line.get("accountNumber")
-                else "Item"
-                if line.get("productNumber")
-                else None
-            )
-            line_map = {
-                "Line_Amount": line.get("totalPrice"),
-                "Description": line.get("description"),
-                "Type": type,
-                "No": str(line.get("accountNumber")),
-                "Quantity": line.get("quantity", 1),
-                "Direct_Unit_Cost": line.get("unitPrice", line.get("totalPrice")),
-            }
-
-            custom_fields = line.get("customFields")
-            line_map.update(self.process_custom_fields(custom_fields))
-            lines.append(line_map)
+        lines = [self.get_line_map(line) for line in pi_lines]
 
         payload = {"purchase_invoice": purchase_order_map, "lines": lines, "attachments": record.get("attachments") or []}
         mapping = self.clean_convert(payload)
 
         return mapping
 
+    def get_line_map(self, line):
+        type = (
+            "G/L Account"
+            if line.get("accountNumber")
+            else "Item"
+            if line.get("productNumber")
+            else None
+        )
+        line_map = {
+            "Line_Amount": line.get("totalPrice"),
+            "Description": line.get("description"),
+            "Type": type,
+            "No": str(line.get("accountNumber")),
+            "Quantity": line.get("quantity", 1),
+            "Direct_Unit_Cost": line.get("unitPrice", line.get("totalPrice")),
+        }
+
+        custom_fields = line.get("customFields")
+        line_map.update(self.process_custom_fields(custom_fields))
+        return line_map
+
+    def iter_line_maps(self, line_items):
+        for line in self.iter_objs(line_items):
+            line_map = self.clean_convert(self.get_line_map(line))
+            if line_map:
+                yield line_map
+
     def upsert_record(self, record: dict, context: dict):
         state_updates = dict()
         if record:
@@ -265,35 +312,43 @@ class Purchase_Invoice(DynamicOnpremSink):
                     self.endpoint.split("/")[0] + "/Purchase_InvoicePurchLines"
                 )
                 self.logger.info("Posting purchase invoice lines")
-                for line in record.get("lines"):
-                    line["Document_Type"] = "Invoice"
-                    line["Document_No"] = purchase_order_no
-                    try:
+                if "lineItems" in record:
+                    lines = self.iter_line_maps(record["lineItems"])
+                else:
+                    lines = record.get("lines")
+
+                # index of the line being decoded or posted
+                line_index = 0
+                try:
+                    for line in lines:
+                        line["Document_Type"] = "Invoice"
+                        line["Document_No"] = purchase_order_no
                         purchase_order_lines = self.request_api(
                             "POST",
                             endpoint=pol_endpoint,
                             request_data=line,
                             params=self.params,
                         )
-                    except Exception as e:
-                        self.logger.info(f"Posting line {line} has failed")
-                        self.logger.info("Deleting purchase order header")
-                        delete_endpoint = (
-                            f"{self.endpoint}('Invoice','{purchase_order_no}')"
-                        )
-                        error = {
-                            "error": e,
-                            "notes": "due to error during posting lines the purchase invoice header was deleted",
-                        }
+                        line_index += 1
+                except Exception as e:
+                    self.logger.info(f"Posting line {line_index} has failed")
+                    self.logger.info("Deleting purchase order header")
+                    delete_endpoint = (
+                        f"{self.endpoint}('Invoice','{purchase_order_no}')"
+                    )
+                    error = {
+                        "error": e,
+                        "notes": "due to error during posting lines the purchase invoice header was deleted",
+                    }
 
-                        try:
-                            purchase_order_lines = self.request_api(
-                                "DELETE", endpoint=delete_endpoint
-                            )
-                        except Exception as e:
-                            error["deleting_failure"] = f"Deleting purchase invoice has failed due to {e}"
+                    try:
+                        purchase_order_lines = self.request_api(
+                            "DELETE", endpoint=delete_endpoint
+                        )
+                    except Exception as e:
+                        error["deleting_failure"] = f"Deleting purchase invoice has failed due to {e}"
 
-                        raise Exception(error)
+                    raise Exception(error)
             
                 # post attachments
                 self.upload_attachments(record.get("attachments"), purchase_order_id, self.attachments_endpoint, "Purchase_x0020_Invoice")
@@ -349,49 +404,71 @@ class PurchaseInvoices(DynamicOnpremSink):
         po_custom_fields = record.get("customFields")
         purchase_order_map.update(self.process_custom_fields(po_custom_fields))
 
+        if self.stream_lines:
+            # lines are mapped and posted one at a time in upsert_record
+            purchase_order_map.pop("purchaseInvoiceLines")
+            mapping = self.clean_convert(purchase_order_map)
+            self.logger.info(f"PAYLOAD {mapping}")
+            mapping["lineItems"] = record.get("lineItems") or []
+            return mapping
+
         # map lines
         pi_lines = record.get("lineItems")
         if isinstance(pi_lines, str):
             pi_lines = self.parse_objs(pi_lines)
         for line in pi_lines:
-            type = (
-                "Account"
-                if line.get("accountNumber")
-                else "Item"
-                if line.get("productNumber")
-                else None
-            )
-            line_map = {
-                "lineType": type,
-                "lineObjectNumber": line.get(
-                    "accountNumber", line.get("productNumber")
-                ),
-                "description": line.get("description"),
-                "quantity": line.get("quantity", 1),
-                "taxCode": line.get("taxCode"),
-                "amountIncludingTax": line.get("unitPrice", line.get("totalPrice")),
-                "dimensionSetLines": []
-            }
-
-            custom_fields = line.get("customFields")
-            if custom_fields:
-                [
-                    line_map["dimensionSetLines"].append(self.get_dimension_line(cf))
-                    if cf.get("name").startswith("DSL")
-                    else line_map.update({cf.get("name"): cf.get("value")})
-                    for cf in custom_fields
-                ]
-
-            purchase_order_map["purchaseInvoiceLines"].append(line_map)
+            purchase_order_map["purchaseInvoiceLines"].append(self.get_line_map(line))
 
         mapping = self.clean_convert(purchase_order_map)
         self.logger.info(f"PAYLOAD {mapping}")
         return mapping
 
+    def get_line_map(self, line):
+        type = (
+            "Account"
+            if line.get("accountNumber")
+            else "Item"
+            if line.get("productNumber")
+            else None
+        )
+        line_map = {
+            "lineType": type,
+            "lineObjectNumber": line.get(
+                "accountNumber", line.get("productNumber")
+            ),
+            "description": line.get("description"),
+            "quantity": line.get("quantity", 1),
+            "taxCode": line.get("taxCode"),
+            "amountIncludingTax": line.get("unitPrice", line.get("totalPrice")),
+            "dimensionSetLines": []
+        }
+
+        custom_fields = line.get("customFields")
+        if custom_fields:
+            [
+                line_map["dimensionSetLines"].append(self.get_dimension_line(cf))
+                if cf.get("name").startswith("DSL")
+                else line_map.update({cf.get("name"): cf.get("value")})
+                for cf in custom_fields
+            ]
+        return line_map
+
+    def iter_line_maps(self, line_items):
+        for line in self.iter_objs(line_items):
+            line_map = self.clean_convert(self.get_line_map(line))
+            if line_map:
+                yield line_map
+
     def upsert_record(self, record: dict, context: dict):
         state_updates = dict()
         if record:
-            lines = record.pop("purchaseInvoiceLines", None)
+            if "lineItems" in record:
+                lines = self.iter_line_maps(record.pop("lineItems"))
+                # only post the header if the document has any lines
+                first_line = next(lines, None)
+                lines = chain([first_line], lines) if first_line else None
+            else:
+                lines = record.pop("purchaseInvoiceLines", None)
             attachments = record.pop("attachments")
             if lines:
                 purchase_order = self.request_api(
@@ -407,9 +484,11 @@ class PurchaseInvoices(DynamicOnpremSink):
                         f"{self.endpoint}({purchase_order_id})/purchaseInvoiceLines"
                     )
                     self.logger.info("Posting purchase invoice lines")
-                    for line in lines:
-                        dimension_set_lines = line.pop("dimensionSetLines", [])
-                        try:
+                    # index of the line being decoded or posted
+                    line_index = 0
+                    try:
+                        for line in lines:
+                            dimension_set_lines = line.pop("dimensionSetLines", [])
                             purchase_order_lines = self.request_api(
                                 "POST",
                                 endpoint=pol_endpoint,
@@ -427,24 +506,25 @@ class PurchaseInvoices(DynamicOnpremSink):
                                     request_data=sdl,
                                     params=self.params,
                                 )
+                            line_index += 1
+
+                    except Exception as e:
+                        self.logger.info(f"Posting line {line_index} has failed")
+                        self.logger.info("Deleting purchase order header")
+                        delete_endpoint = f"{self.endpoint}({purchase_order_id})"
+                        error = {
+                            "error": e,
+                            "notes": "due to error during posting lines the purchase invoice header was deleted",
+                        }
 
+                        try:
+                            purchase_order_lines = self.request_api(
+                                "DELETE", endpoint=delete_endpoint
+                            )
                         except Exception as e:
-                            self.logger.info(f"Posting line {line} has failed")
-                            self.logger.info("Deleting purchase order header")
-                            delete_endpoint = f"{self.endpoint}({purchase_order_id})"
-                            error = {
-                                "error": e,
-                                "notes": "due to error during posting lines the purchase invoice header was deleted",
-                            }
-
-                            try:
-                                purchase_order_lines = self.request_api(
-                                    "DELETE", endpoint=delete_endpoint
-                                )
-                            except Exception as e:
-                                error["deleting_failure"] = f"Deleting purchase invoice has failed due to {e}"
+                            error["deleting_failure"] = f"Deleting purchase invoice has failed due to {e}"
 
-                            raise Exception(error)
+                        raise Exception(error)
 
                     # process attachments
                     self.upload_attachments(attachments, purchase_order_id, self.attachments_endpoint, "Purchase_x0020_Invoice")
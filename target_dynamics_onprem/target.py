@@ -1,6 +1,10 @@
 """Dynamics-onprem target class."""
+from collections import Counter, defaultdict
+from functools import partial
+
 from target_hotglue.target import TargetHotglue
 from singer_sdk import typing as th
+from singer_sdk.io_base import SingerMessageType
 
 from target_dynamics_onprem.sinks import (
     Vendors,
@@ -9,6 +13,12 @@ from target_dynamics_onprem.sinks import (
     PurchaseInvoices,
     Purchase_Invoice
 )
+from target_dynamics_onprem.ingest import (
+    DEFAULT_BUFFER_SIZE,
+    ValidatorCache,
+    iter_messages,
+)
+from target_dynamics_onprem.scheduler import StreamScheduler
 from singer_sdk.sinks import Sink
 from typing import Type
 
@@ -18,6 +28,9 @@ class TargetDynamicsOnprem(TargetHotglue):
     name = "target-dynamics-onprem"
     SINK_TYPES = [Vendors, Items, PurchaseDocuments, PurchaseInvoices, Purchase_Invoice]
     MAX_PARALLELISM = 10
+    _validator_cache = None
+    _scheduler = None
+    _drain_requested = False
     config_jsonschema = th.PropertiesList(
         th.Property(
             "username",
@@ -39,8 +52,126 @@ class TargetDynamicsOnprem(TargetHotglue):
             "url_base",
             th.StringType,
         ),
+        th.Property(
+            "fast_ingest",
+            th.BooleanType,
+        ),
+        th.Property(
+            "ingest_buffer_size",
+            th.IntegerType,
+        ),
+        th.Property(
+            "concurrent_streams",
+            th.BooleanType,
+        ),
+        th.Property(
+            "scheduler_max_queued",
+            th.IntegerType,
+        ),
+        th.Property(
+            "stream_document_lines",
+            th.BooleanType,
+        ),
     ).to_dict()
 
+    @property
+    def validator_cache(self) -> ValidatorCache:
+        if self._validator_cache is None:
+            self._validator_cache = ValidatorCache()
+        return self._validator_cache
+
+    def _process_lines(self, file_input) -> Counter:
+        if not self.config.get("fast_ingest"):
+            return super()._process_lines(file_input)
+
+        # fast ingest: large buffered reads and orjson decoding, floats are
+        # still decoded as Decimal like the SDK reader does
+        buffer_size = self.config.get("ingest_buffer_size") or DEFAULT_BUFFER_SIZE
+        self.logger.info(f"Target '{self.name}' is listening for input from tap.")
+        stats = defaultdict(int)
+        for line_dict in iter_messages(file_input, buffer_size, self.logger):
+            self._assert_line_requires(line_dict, requires={"type"})
+
+            record_type = line_dict["type"]
+            if record_type == SingerMessageType.SCHEMA:
+                self._process_schema_message(line_dict)
+            elif record_type == SingerMessageType.RECORD:
+                self._process_record_message(line_dict)
+            elif record_type == SingerMessageType.ACTIVATE_VERSION:
+                self._process_activate_version_message(line_dict)
+            elif record_type == SingerMessageType.STATE:
+                self._process_state_message(line_dict)
+            else:
+                self._process_unknown_message(line_dict)
+
+            stats[record_type] += 1
+
+        counter = Counter(**stats)
+        line_count = sum(counter.values())
+        self.logger.info(
+            f"Target '{self.name}' completed reading {line_count} lines of input "
+            f"({counter[SingerMessageType.RECORD]} records, "
+            f"{counter[SingerMessageType.STATE]} state messages)."
+        )
+        return counter
+
+    @property
+    def scheduler(self):
+        if self._scheduler is None and self.config.get("concurrent_streams"):
+            self._scheduler = StreamScheduler(
+                self.MAX_PARALLELISM,
+                max_queued=self.config.get("scheduler_max_queued"),
+                logger=self.logger,
+            )
+        return self._scheduler
+
+    def _wait_for_scheduler(self):
+        # records must be processed before sinks change or state is drained
+        if self.scheduler:
+            self.scheduler.wait()
+
+    def _process_record_message(self, message_dict: dict) -> None:
+        if not self.scheduler:
+            return super()._process_record_message(message_dict)
+        self._assert_line_requires(message_dict, requires={"stream", "record"})
+        self.scheduler.submit(
+            message_dict["stream"],
+            message_dict["record"],
+            partial(super()._process_record_message, message_dict),
+        )
+        if self._drain_requested:
+            # a worker asked for a drain, run it once every queued record is done
+            self.drain_all()
+
+    def _process_schema_message(self, message_dict: dict) -> None:
+        self._wait_for_scheduler()
+        super()._process_schema_message(message_dict)
+
+    def _process_activate_version_message(self, message_dict: dict) -> None:
+        self._wait_for_scheduler()
+        super()._process_activate_version_message(message_dict)
+
+    def drain_one(self, sink: Sink) -> None:
+        if self.scheduler and self.scheduler.in_worker():
+            self._drain_requested = True
+            return
+        super().drain_one(sink)
+
+    def drain_all(self, *args, **kwargs) -> None:
+        if self.scheduler and self.scheduler.in_worker():
+            # never drain from a worker while other streams are still running
+            self._drain_requested = True
+            return
+        self._wait_for_scheduler()
+        self._drain_requested = False
+        super().drain_all(*args, **kwargs)
+
+    def _process_endofpipe(self) -> None:
+        self._wait_for_scheduler()
+        super()._process_endofpipe()
+        if self._scheduler:
+            self._scheduler.shutdown()
+
     def get_sink_class(self, stream_name: str) -> Type[Sink]:
         for sink_class in self.SINK_TYPES:
             # Search for streams with multiple names
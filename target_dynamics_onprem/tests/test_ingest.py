@@ -0,0 +1,117 @@
+"""Tests for the fast ingest helpers."""
+
+import copy
+import decimal
+import io
+import logging
+
+import pytest
+from jsonschema import Draft7Validator, FormatChecker, ValidationError
+
+from target_dynamics_onprem.ingest import CompiledValidator, iter_array, iter_messages
+
+SCHEMA = {
+    "type": ["object", "null"],
+    "properties": {
+        "createdAt": {"type": ["string", "null"], "format": "date-time"},
+        "dueDate": {"type": ["string", "null"], "format": "date"},
+        "emailAddress": {"type": ["string", "null"], "format": "email"},
+        "totalAmount": {"type": ["number", "null"]},
+        "quantity": {"type": ["integer", "null"]},
+        "active": {"type": ["boolean", "null"]},
+        "currency": {"type": ["string", "null"], "default": "USD"},
+        "lineItems": {
+            "type": ["array", "string", "null"],
+            "items": {"type": "object", "properties": {"unitPrice": {"type": "number"}}},
+        },
+    },
+}
+
+RECORDS = [
+    {"createdAt": "2023-01-01T00:00:00Z"},
+    {"createdAt": "2023-01-01T00:00:00"},
+    {"createdAt": "2023-01-01"},
+    {"createdAt": "not a date"},
+    {"dueDate": "2023-01-01"},
+    {"dueDate": "2023-13-45"},
+    {"emailAddress": "probando@correo.com"},
+    {"emailAddress": "not an email"},
+    {"totalAmount": decimal.Decimal("10.50")},
+    {"totalAmount": 10},
+    {"totalAmount": "10.50"},
+    {"quantity": 1},
+    {"quantity": 1.0},
+    {"quantity": decimal.Decimal("1")},
+    {"quantity": True},
+    {"active": 1},
+    {"lineItems": "[{\"unitPrice\": 1}]"},
+    {"lineItems": [{"unitPrice": decimal.Decimal("1.5")}]},
+    {"lineItems": [{"unitPrice": "1.5"}]},
+    {},
+]
+
+
+def accepts(validate, record):
+    try:
+        validate(record)
+        return True
+    except Exception:
+        return False
+
+
+@pytest.mark.parametrize("record", RECORDS)
+def test_compiled_validator_matches_jsonschema(record):
+    """The fast validator accepts and rejects exactly what jsonschema does."""
+    default = Draft7Validator(SCHEMA, format_checker=FormatChecker())
+    compiled = CompiledValidator(SCHEMA)
+    assert accepts(compiled.validate, copy.deepcopy(record)) == accepts(
+        default.validate, copy.deepcopy(record)
+    )
+
+
+def test_compiled_validator_does_not_change_record():
+    record = {"createdAt": "2023-01-01T00:00:00Z"}
+    CompiledValidator(SCHEMA).validate(record)
+    assert record == {"createdAt": "2023-01-01T00:00:00Z"}
+
+
+def test_compiled_validator_raises_jsonschema_error():
+    with pytest.raises(ValidationError):
+        CompiledValidator(SCHEMA).validate({"totalAmount": "10.50"})
+
+
+def test_iter_messages_decodes_floats_as_decimal():
+    data = io.BytesIO(
+        b'{"type": "RECORD", "stream": "Bills", "record": {"totalAmount": 10.50, "quantity": 2}}\n'
+        b'\n'
+        b'{"type": "STATE", "value": {}}\n'
+    )
+    messages = list(iter_messages(data))
+    assert messages[0]["record"]["totalAmount"] == decimal.Decimal("10.50")
+    assert isinstance(messages[0]["record"]["totalAmount"], decimal.Decimal)
+    assert messages[0]["record"]["quantity"] == 2
+    assert messages[1] == {"type": "STATE", "value": {}}
+
+
+def test_iter_messages_logs_unparseable_line(caplog):
+    logger = logging.getLogger("test_ingest")
+    with pytest.raises(ValueError):
+        list(iter_messages(io.BytesIO(b'{"type": "RECORD"\n'), logger=logger))
+    assert "Unable to parse" in caplog.text
+
+
+def test_iter_messages_leaves_binary_input_open():
+    data = io.BytesIO(b'{"type": "STATE", "value": {"bookmarks": {}}}\n')
+    assert list(iter_messages(data)) == [{"type": "STATE", "value": {"bookmarks": {}}}]
+    assert not data.closed
+
+
+def test_iter_array():
+    assert list(iter_array('[{"a": 1}, {"b": 2.5}]')) == [{"a": 1}, {"b": 2.5}]
+    assert list(iter_array("[{'a': None}]")) == [{"a": None}]
+    assert list(iter_array([{"a": 1}])) == [{"a": 1}]
+    assert list(iter_array(None)) == []
+    items = iter_array('[{"a": 1}, {"b"')
+    assert next(items) == {"a": 1}
+    with pytest.raises(ValueError):
+        next(items)
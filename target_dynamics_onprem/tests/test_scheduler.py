@@ -0,0 +1,101 @@
+"""Tests for the dependency-aware stream scheduler."""
+
+import threading
+import time
+
+import pytest
+
+from target_dynamics_onprem.scheduler import StreamScheduler
+
+
+def record_job(log, name, delay=0):
+    def job():
+        time.sleep(delay)
+        log.append(name)
+
+    return job
+
+
+def test_held_document_runs_after_its_vendor_and_item():
+    log = []
+    scheduler = StreamScheduler(4)
+    scheduler.submit("Vendors", {"id": "V1"}, record_job(log, "V1", 0.2))
+    scheduler.submit("Items", {"id": "I1"}, record_job(log, "I1", 0.1))
+    scheduler.submit("Bills", {"vendorId": "V1"}, record_job(log, "B1"))
+    scheduler.submit(
+        "PurchaseOrders",
+        {"vendorId": "X", "lineItems": '[{"productId": "I1"}]'},
+        record_job(log, "PO1"),
+    )
+    scheduler.shutdown()
+    assert log.index("B1") > log.index("V1")
+    assert log.index("PO1") > log.index("I1")
+
+
+def test_independent_documents_go_ahead_of_held_one():
+    log = []
+    scheduler = StreamScheduler(4)
+    scheduler.submit("Vendors", {"id": "V1"}, record_job(log, "V1", 0.3))
+    scheduler.submit("Bills", {"vendorId": "V1"}, record_job(log, "B1"))
+    scheduler.submit("Bills", {"vendorId": "V2"}, record_job(log, "B2"))
+    scheduler.submit("Bills", {"lineItems": [{"productId": "I9"}]}, record_job(log, "B3"))
+    scheduler.shutdown()
+    assert log == ["B2", "B3", "V1", "B1"]
+
+
+def test_document_before_its_vendor_is_not_held():
+    log = []
+    scheduler = StreamScheduler(4)
+    scheduler.submit("Bills", {"vendorId": "V1"}, record_job(log, "B1", 0.1))
+    scheduler.submit("Vendors", {"id": "V1"}, record_job(log, "V1"))
+    scheduler.shutdown()
+    assert log == ["V1", "B1"]
+
+
+def test_error_is_raised_at_wait():
+    scheduler = StreamScheduler(2)
+
+    def fail():
+        raise ValueError("boom")
+
+    scheduler.submit("Items", {"id": "I1"}, fail)
+    with pytest.raises(ValueError, match="boom"):
+        scheduler.wait()
+    # the error is only raised once
+    scheduler.shutdown()
+
+
+def test_no_deadlock_when_queue_is_full_behind_held_document():
+    log = []
+    scheduler = StreamScheduler(2, max_queued=2)
+
+    def submit_all():
+        scheduler.submit("Vendors", {"id": "V1"}, record_job(log, "V1", 0.2))
+        scheduler.submit("Bills", {"vendorId": "V1"}, record_job(log, "B1"))
+        # blocks until the queue has room again
+        scheduler.submit("Bills", {"vendorId": "V1"}, record_job(log, "B2"))
+        scheduler.submit("Bills", {"vendorId": "V2"}, record_job(log, "B3"))
+        scheduler.wait()
+
+    thread = threading.Thread(target=submit_all, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert log[:2] == ["V1", "B1"]
+    assert sorted(log) == ["B1", "B2", "B3", "V1"]
+    scheduler.shutdown()
+
+
+def test_lines_only_scanned_while_an_item_is_pending(monkeypatch):
+    scanned = []
+    monkeypatch.setattr(
+        StreamScheduler, "iter_lines", staticmethod(lambda lines: scanned.append(lines) or [])
+    )
+    scheduler = StreamScheduler(1)
+    assert scheduler.requires("Bills", {"lineItems": '[{"productId": "I1"}]'}) == []
+    assert scanned == []
+
+    scheduler.submit("Items", {"id": "I1"}, record_job([], "I1", 0.1))
+    scheduler.requires("Bills", {"lineItems": '[{"productId": "I1"}]'})
+    assert scanned == ['[{"productId": "I1"}]']
+    scheduler.shutdown()
@@ -0,0 +1,168 @@
+"""Tests for the sharded run coordinator."""
+
+import json
+import os
+import sys
+import zlib
+
+from target_dynamics_onprem.shard import Shard, merge_states, run, shard_for, split
+
+# Fake worker: one successful bookmark per record, like the target's STATE.
+# If the fail file exists it is removed, and the worker fails after writing
+# a STATE for its first two records.
+WORKER = """
+import json, os, sys
+fail_file = sys.argv[1]
+fail = os.path.exists(fail_file)
+bookmarks, summary = {}, {}
+for line in sys.stdin:
+    message = json.loads(line)
+    if message["type"] != "RECORD":
+        continue
+    stream = message["stream"]
+    bookmarks.setdefault(stream, []).append({"id": message["record"]["id"], "success": True})
+    summary.setdefault(stream, {"success": 0})
+    summary[stream]["success"] += 1
+    if fail and sum(len(v) for v in bookmarks.values()) == 2:
+        print(json.dumps({"type": "STATE", "value": {"bookmarks": bookmarks, "summary": summary}}))
+        sys.stdout.flush()
+        os.remove(fail_file)
+        sys.exit(3)
+print(json.dumps({"type": "STATE", "value": {"bookmarks": bookmarks, "summary": summary}}))
+"""
+
+
+def write_input(path, ids, stream="Bills"):
+    with open(path, "w") as f:
+        f.write(json.dumps({"type": "SCHEMA", "stream": stream, "schema": {}, "key_properties": []}) + "\n")
+        for i in ids:
+            f.write(json.dumps({"type": "RECORD", "stream": stream, "record": {"id": i}}) + "\n")
+
+
+def make_shards(tmp_path, count):
+    worker = tmp_path / "worker.py"
+    worker.write_text(WORKER)
+    command = f"{sys.executable} {worker} {tmp_path / 'fail'}"
+    return [Shard(i, str(tmp_path), command) for i in range(count)]
+
+
+def test_shard_for_is_deterministic():
+    record = {"id": "d1", "subsidiary": "C", "lineItems": [{"productId": "P1"}]}
+    same_document = {"lineItems": [], "subsidiary": "C", "id": "d1"}
+    assert shard_for(record, 4) == zlib.crc32(b"C:d1") % 4
+    assert shard_for(record, 4) == shard_for(same_document, 4)
+    assert shard_for({"id": "d1"}, 4, company_id="C") == shard_for(record, 4)
+    # without an id the record content is hashed, independent of key order
+    assert shard_for({"a": 1, "b": 2}, 8) == shard_for({"b": 2, "a": 1}, 8)
+
+
+def test_merge_states_orders_bookmarks_and_sums_counters():
+    routing = {"Bills": [1, 0, 1, 0], "Vendors": [0]}
+    states = [
+        {"bookmarks": {"Bills": [{"id": "b2"}, {"id": "b4"}], "Vendors": [{"id": "v1"}]},
+         "summary": {"Bills": {"success": 2, "fail": 0}, "Vendors": {"success": 1}}},
+        {"bookmarks": {"Bills": [{"id": "b1"}, {"id": "b3"}]},
+         "summary": {"Bills": {"success": 1, "fail": 1}}},
+    ]
+    merged = merge_states(states, routing)
+    assert [e["id"] for e in merged["bookmarks"]["Bills"]] == ["b1", "b2", "b3", "b4"]
+    assert merged["bookmarks"]["Vendors"] == [{"id": "v1"}]
+    assert merged["summary"] == {"Bills": {"success": 3, "fail": 1}, "Vendors": {"success": 1}}
+
+
+def test_split_routes_records_and_broadcasts_schema(tmp_path):
+    shards = make_shards(tmp_path, 2)
+    write_input(tmp_path / "in.singer", [f"d{i}" for i in range(6)])
+    with open(tmp_path / "in.singer", "rb") as f:
+        routing = split(f, shards, "C")
+    assert routing["Bills"] == [shard_for({"id": f"d{i}"}, 2, "C") for i in range(6)]
+    for shard in shards:
+        with open(shard.input_path) as f:
+            types = [json.loads(line)["type"] for line in f]
+        assert types[0] == "SCHEMA"
+        assert types.count("RECORD") == shard.records
+
+
+def test_run_skips_done_shards(tmp_path):
+    shards = make_shards(tmp_path, 2)
+    for shard in shards:
+        write_input(shard.input_path, [f"s{shard.index}"])
+        shard.records = 1
+    with open(shards[0].done_path, "w") as f:
+        f.write("{}")
+
+    assert run(shards, retries=0, progress_interval=60) == []
+    assert shards[0].attempts == 0
+    assert not os.path.exists(shards[0].output_path)
+    assert shards[1].done
+
+
+def test_retry_skips_records_that_already_succeeded(tmp_path):
+    (tmp_path / "fail").write_text("")
+    shard = make_shards(tmp_path, 1)[0]
+    write_input(shard.input_path, ["d0", "d1", "d2", "d3"])
+    shard.records = 4
+
+    assert run([shard], retries=1, progress_interval=60) == []
+    assert shard.attempts == 2
+    with open(shard.retry_input_path) as f:
+        retried = [json.loads(line) for line in f]
+    assert [m["record"]["id"] for m in retried if m["type"] == "RECORD"] == ["d2", "d3"]
+
+    state = shard.final_state()
+    assert [e["id"] for e in state["bookmarks"]["Bills"]] == ["d0", "d1", "d2", "d3"]
+    assert state["summary"]["Bills"]["success"] == 4
+
+
+def test_resume_keeps_results_of_failed_attempt(tmp_path):
+    (tmp_path / "fail").write_text("")
+    shard = make_shards(tmp_path, 1)[0]
+    write_input(shard.input_path, ["d0", "d1", "d2"])
+    shard.records = 3
+    assert run([shard], retries=0, progress_interval=60) == [shard]
+
+    resumed = make_shards(tmp_path, 1)[0]
+    resumed.records = 3
+    resumed.load()
+    assert run([resumed], retries=0, progress_interval=60) == []
+    assert [e["id"] for e in resumed.final_state()["bookmarks"]["Bills"]] == ["d0", "d1", "d2"]
+
+
+def test_results_match_reordered_bookmarks_by_external_id(tmp_path):
+    shard = make_shards(tmp_path, 1)[0]
+    with open(shard.input_path, "w") as f:
+        for i in range(3):
+            record = {"id": f"d{i}", "externalId": f"e{i}"}
+            f.write(json.dumps({"type": "RECORD", "stream": "Bills", "record": record}) + "\n")
+    shard.records = 3
+    shard.attempts = 1
+    shard.write_attempt_input()
+    # e.g. d0 held back by concurrent streams and processed last
+    bookmarks = [
+        {"id": "x2", "externalId": "e2", "success": True},
+        {"id": "x1", "externalId": "e1", "success": True},
+        {"externalId": "e0", "success": False},
+    ]
+    with open(shard.output_path, "w") as f:
+        f.write(json.dumps({"type": "STATE", "value": {"bookmarks": {"Bills": bookmarks}}}) + "\n")
+
+    shard.collect(succeeded=False)
+    assert shard.results["Bills"] == {"1": bookmarks[1], "2": bookmarks[0]}
+    with open(shard.write_attempt_input()) as f:
+        retried = [json.loads(line)["record"]["id"] for line in f]
+    assert retried == ["d0"]
+
+
+def test_shard_without_records_left_is_done_without_worker(tmp_path):
+    (tmp_path / "fail").write_text("")
+    shard = make_shards(tmp_path, 1)[0]
+    # the worker fails after reporting both records as successful
+    write_input(shard.input_path, ["d0", "d1"])
+    shard.records = 2
+
+    assert run([shard], retries=1, progress_interval=60) == []
+    assert shard.attempts == 1
+    assert shard.done
+    state = shard.final_state()
+    assert [e["id"] for e in state["bookmarks"]["Bills"]] == ["d0", "d1"]
+    assert state["summary"] == {"Bills": {"success": 2}}
@@ -0,0 +1,98 @@
+"""Tests for streaming purchase document lines."""
+
+import json
+import logging
+
+import pytest
+
+from target_dynamics_onprem.sinks import PurchaseDocuments, PurchaseInvoices
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def make_sink(sink_class, stream_name, config=None):
+    """Build a sink without a target, recording every API call."""
+    sink = sink_class.__new__(sink_class)
+    sink._config = dict({"url_base": "http://localhost/api/", "company_id": "C"}, **(config or {}))
+    sink.stream_name = stream_name
+    sink.logger = logging.getLogger("test_sinks")
+    sink.calls = []
+    sink.fail_on = None
+
+    def request_api(http_method, endpoint=None, params={}, request_data=None, headers={}, json=True):
+        sink.calls.append((http_method, endpoint, request_data))
+        if http_method == "POST" and sink.fail_on and request_data.get("description") == sink.fail_on:
+            raise Exception("line rejected")
+        return Response({"id": "H1", "number": "PO1", "documentType": "Order"})
+
+    sink.request_api = request_api
+    sink.upload_attachments = lambda *args: None
+    return sink
+
+
+def test_iter_objs_json_string():
+    sink = make_sink(PurchaseDocuments, "PurchaseOrders")
+    assert list(sink.iter_objs('[{"a": 1}, {"b": 2}]')) == [{"a": 1}, {"b": 2}]
+    assert list(sink.iter_objs("[]")) == []
+    assert list(sink.iter_objs([{"a": 1}])) == [{"a": 1}]
+
+
+def test_iter_objs_python_literal_falls_back_to_parse_objs():
+    sink = make_sink(PurchaseDocuments, "PurchaseOrders")
+    assert list(sink.iter_objs("[{'a': 1, 'b': None}]")) == [{"a": 1, "b": None}]
+
+
+def test_iter_objs_truncated_array_fails_partway():
+    sink = make_sink(PurchaseDocuments, "PurchaseOrders")
+    items = sink.iter_objs('[{"a": 1}, {"b": 2}, {"c"')
+    assert next(items) == {"a": 1}
+    assert next(items) == {"b": 2}
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def line_items(count):
+    return [
+        {"productId": f"P{i}", "productName": f"line {i}", "quantity": 1, "unitPrice": 2}
+        for i in range(count)
+    ]
+
+
+@pytest.mark.parametrize("stream_lines", [False, True])
+def test_purchase_document_lines_are_the_same_in_both_modes(stream_lines):
+    sink = make_sink(PurchaseDocuments, "PurchaseOrders", {"stream_document_lines": stream_lines})
+    record = sink.preprocess_record({"vendorId": "V1", "lineItems": line_items(3)}, {})
+    sink.upsert_record(record, {})
+    posted = [data for method, endpoint, data in sink.calls if endpoint.endswith("/purchaseDocumentLines")]
+    assert [line["lineNumber"] for line in posted[1:]] == [1, 2]
+    assert [line["number"] for line in posted] == ["P0", "P1", "P2"]
+    assert all(line["documentNumber"] == "PO1" for line in posted)
+
+
+def test_purchase_document_header_deleted_when_later_line_fails():
+    sink = make_sink(PurchaseDocuments, "PurchaseOrders", {"stream_document_lines": True})
+    sink.fail_on = "line 2"
+    record = sink.preprocess_record({"vendorId": "V1", "lineItems": line_items(4)}, {})
+    with pytest.raises(Exception):
+        sink.upsert_record(record, {})
+    methods = [method for method, endpoint, data in sink.calls]
+    assert methods == ["POST", "POST", "POST", "POST", "DELETE"]
+    assert sink.calls[-1][1] == "(C)/purchaseDocuments(H1)"
+
+
+def test_purchase_invoice_header_deleted_when_later_line_cannot_be_decoded(caplog):
+    sink = make_sink(PurchaseInvoices, "Bills", {"stream_document_lines": True})
+    lines = json.dumps([{"accountNumber": "A1", "description": "line 0"}])[:-1] + ', {"accountNumber"'
+    record = sink.preprocess_record({"vendorId": "V1", "lineItems": lines}, {})
+    with caplog.at_level(logging.INFO, logger="test_sinks"):
+        with pytest.raises(Exception):
+            sink.upsert_record(record, {})
+    methods = [method for method, endpoint, data in sink.calls]
+    assert methods == ["POST", "POST", "DELETE"]
+    assert "Posting line 1 has failed" in caplog.text